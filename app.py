@@ -1,14 +1,69 @@
+import atexit
+import contextlib
+import gc
+import io
+import itertools
+import os
 import platform
+import queue
+import shutil
+import tempfile
+import threading
 import time
-from io import BytesIO
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+from openpyxl import load_workbook
+
+# -------- Leitor de Excel: python-calamine (Rust) quando instalado, senão openpyxl --------
+try:
+    from python_calamine import CalamineWorkbook
+    _ENGINE = "calamine"
+except ImportError:
+    CalamineWorkbook = None
+    _ENGINE = "openpyxl"
+
+# -------- SAP RFC (opcional, requer SAP NW RFC SDK) --------
+try:
+    from pyrfc import Connection as RfcConnection
+except ImportError:
+    RfcConnection = None
 
 # -------- SAP automation imports (Windows only) --------
 if platform.system().lower().startswith("win"):
+    import ctypes
+    from ctypes import wintypes
+
+    import pythoncom
     import win32com.client
-    import win32clipboard
+
+    # Clipboard direto via user32/kernel32 (evita o overhead do win32clipboard)
+    CF_UNICODETEXT = 13
+    GMEM_MOVEABLE = 0x0002
+
+    _user32 = ctypes.WinDLL("user32", use_last_error=True)
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+
+    _user32.OpenClipboard.argtypes = [wintypes.HWND]
+    _user32.OpenClipboard.restype = wintypes.BOOL
+    _user32.EmptyClipboard.argtypes = []
+    _user32.EmptyClipboard.restype = wintypes.BOOL
+    _user32.SetClipboardData.argtypes = [wintypes.UINT, wintypes.HANDLE]
+    _user32.SetClipboardData.restype = wintypes.HANDLE
+    _user32.CloseClipboard.argtypes = []
+    _user32.CloseClipboard.restype = wintypes.BOOL
+
+    _kernel32.GlobalAlloc.argtypes = [wintypes.UINT, ctypes.c_size_t]
+    _kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+    _kernel32.GlobalLock.argtypes = [wintypes.HGLOBAL]
+    _kernel32.GlobalLock.restype = wintypes.LPVOID
+    _kernel32.GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+    _kernel32.GlobalUnlock.restype = wintypes.BOOL
+    _kernel32.GlobalFree.argtypes = [wintypes.HGLOBAL]
+    _kernel32.GlobalFree.restype = wintypes.HGLOBAL
 
 
 # ======================================================
@@ -26,13 +81,22 @@ SAP_IDS = {
         "wnd[0]/usr/subSUB_ALL:SAPLCOIH:3001/ssubSUB_LEVEL:SAPLCOIH:110 7/"
         "tabsTS_1100/tabpVGUE/ssubSUB_AUFTRAG:SAPLCOVG:3010/tblSAPLCOVGTCTRL_3010/btnLT ICON-LTOPR[8,{row}]"
     ),
+    "COL_TEXTO_LONGO": 8,
     "LONGTEXT_SHELL_ID": "wnd[0]/usr/cntlSCMSW_CONTAINER_2102/shellcont/shell",
     "BTN_BACK_ID": "wnd[0]/tbar[0]/btn[3]",
+    # Botão "próxima operação" dentro do editor de texto longo (varia por sistema; vazio = desativado)
+    "BTN_NEXT_TEXT_ID": "",
     "BTN_SAVE_ID": "wnd[0]/tbar[0]/btn[11]",
 }
 
 VISIBLE_ROWS_DEFAULT = 15
 
+# Colunas da planilha exibidas na prévia (além de OS e texto longo)
+PREVIEW_COLS = ["Operação", "Material", "Texto breve material", "Quantidade", "Centro"]
+
+# Linhas de texto longo no SAP (TDLINE) têm no máximo 132 caracteres
+RFC_TEXT_LINE_LEN = 132
+
 
 # ======================================================
 # UTILIDADES - EXCEL
@@ -48,57 +112,203 @@ def _normalize_cols(cols):
     return out
 
 
-def autodetect_header_row(excel_bytes: bytes, sheet_name: str, max_scan_rows: int = 30):
+def _fold(name) -> str:
+    # minúsculas e sem acentos ("OPERAÇÃO" -> "operacao")
+    s = unicodedata.normalize("NFKD", str(name).strip().lower())
+    return "".join(ch for ch in s if not unicodedata.combining(ch))
+
+
+def _remove_file(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+
+def _spill_to_tempfile(uploaded) -> str:
+    """Copia o upload para um arquivo temporário em blocos de 1 MB, sem manter o conteúdo em memória."""
+    uploaded.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+        shutil.copyfileobj(uploaded, tmp, length=1 << 20)
+    atexit.register(_remove_file, tmp.name)
+    return tmp.name
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _calamine_sheet(xlsx_path: str, sheet_name: str):
+    """Aba carregada uma única vez pelo calamine e reaproveitada por detecção de cabeçalho e leitura.
+
+    O calamine sempre processa a aba inteira; os dados ficam no lado Rust, não como objetos Python.
+    O lock serializa as iterações (o objeto é compartilhado entre as threads do script).
+    """
+    with CalamineWorkbook.from_path(xlsx_path) as wb:
+        return wb.get_sheet_by_name(sheet_name), threading.Lock()
+
+
+@contextlib.contextmanager
+def _sheet_rows(xlsx_path: str, sheet_name: str, start: int = 0, stop: int | None = None):
+    """Linhas da aba como tuplas (None nas células vazias), da linha `start` até `stop` (base 0)."""
+    if _ENGINE == "calamine":
+        ws, lock = _calamine_sheet(xlsx_path, sheet_name)
+        # iter_rows já começa na linha 0 do Excel, mas as colunas começam na primeira usada
+        pad = (None,) * (ws.start[1] if ws.start else 0)
+        with lock:
+            rows = itertools.islice(ws.iter_rows(), start, stop)
+            yield (pad + tuple(None if v == "" else v for v in r) for r in rows)
+    else:
+        wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+        try:
+            yield wb[sheet_name].iter_rows(min_row=start + 1, max_row=stop, values_only=True)
+        finally:
+            wb.close()
+
+
+def autodetect_header_row(xlsx_path: str, sheet_name: str, max_scan_rows: int = 30):
     """Tenta localizar a linha de cabeçalho procurando por 'OS' e 'Máscara'."""
-    preview = pd.read_excel(BytesIO(excel_bytes), sheet_name=sheet_name, engine="openpyxl", header=None, nrows=max_scan_rows)
-    for idx in range(len(preview)):
-        row = preview.iloc[idx].astype(str).str.strip().str.lower().tolist()
-        if ("os" in row) and ("máscara" in row or "mascara" in row):
-            return idx
+    with _sheet_rows(xlsx_path, sheet_name, stop=max_scan_rows) as it:
+        # para na primeira linha que bate; normalmente o cabeçalho está nas primeiras linhas
+        for idx, row in enumerate(it):
+            lowered = {str(c).strip().lower() for c in row if c is not None}
+            if "os" in lowered and ("máscara" in lowered or "mascara" in lowered):
+                return idx
     return None
 
 
-def load_dataframe(excel_bytes: bytes, sheet_name: str, header_row: int | None):
+def _normalize_header(header) -> list:
+    cols = [c if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+    cols = _normalize_cols(cols)
+
+    # Normaliza nomes principais se vierem com espaços
+    out = []
+    for c in cols:
+        if isinstance(c, str):
+            if c.lower() == "status":
+                c = "Status"
+            elif c.lower() in ("máscara", "mascara"):
+                c = "Máscara"
+        out.append(c)
+    return _dedup_names(out)
+
+
+def _dedup_names(cols: list) -> list:
+    # mesmo esquema do read_excel: Texto, Texto.1, ... pulando nomes que já existem no cabeçalho
+    names = set(cols)
+    counts = {}
+    out = []
+    for c in cols:
+        base = c
+        cur = counts.get(c, 0)
+        while cur > 0:
+            counts[base] = cur + 1
+            c = f"{base}.{cur}"
+            cur = cur + 1 if c in names else counts.get(c, 0)
+        out.append(c)
+        counts[c] = cur + 1
+    return out
+
+
+def _trim_trailing_blank(rows, keep: list):
+    """Projeta as colunas `keep`; linhas vazias só saem se vier dado depois (como no read_excel)."""
+    pending = []
+    for r in rows:
+        row = tuple(r[i] if i < len(r) else None for i in keep)
+        if any(v is not None for v in r):
+            yield from pending
+            pending.clear()
+            yield row
+        else:
+            pending.append(row)
+
+
+def read_header(xlsx_path: str, sheet_name: str, header_row: int | None) -> list:
+    """Lê apenas a linha de cabeçalho (nomes de colunas já normalizados)."""
     if header_row is None:
-        # fallback: tenta padrão do seu arquivo
         header_row = 3
 
-    df = pd.read_excel(BytesIO(excel_bytes), sheet_name=sheet_name, engine="openpyxl", header=header_row)
-    df.columns = _normalize_cols(df.columns)
+    with _sheet_rows(xlsx_path, sheet_name, start=header_row, stop=header_row + 1) as it:
+        return _normalize_header(next(it, ()))
 
-    # Normaliza nomes principais se vierem com espaços
-    rename_map = {}
-    for c in df.columns:
-        if isinstance(c, str):
-            if c.strip().lower() == "status":
-                rename_map[c] = "Status"
-            if c.strip().lower() == "máscara" or c.strip().lower() == "mascara":
-                rename_map[c] = "Máscara"
-    if rename_map:
-        df = df.rename(columns=rename_map)
 
+def _read_sheet_stream(xlsx_path: str, sheet_name: str, header_row: int,
+                       usecols=None, dtype: dict | None = None) -> pd.DataFrame:
+    """Lê só a aba pedida, linha a linha, a partir do cabeçalho."""
+    with _sheet_rows(xlsx_path, sheet_name, start=header_row) as it:
+        cols = _normalize_header(next(it, ()))
+        keep = [i for i, c in enumerate(cols) if usecols is None or c in usecols]
+        df = pd.DataFrame(_trim_trailing_blank(it, keep), columns=[cols[i] for i in keep])
+
+    if dtype:
+        df = df.astype({c: t for c, t in dtype.items() if c in df.columns})
     return df
 
 
+def load_dataframe(xlsx_path: str, sheet_name: str, header_row: int | None,
+                   usecols=None, dtype: dict | None = None):
+    if header_row is None:
+        # fallback: tenta padrão do seu arquivo
+        header_row = 3
+
+    return _read_sheet_stream(xlsx_path, sheet_name, header_row, usecols=usecols, dtype=dtype)
+
+
+@st.cache_data(show_spinner=False)
+def _sheet_names(xlsx_path: str) -> list[str]:
+    if _ENGINE == "calamine":
+        with CalamineWorkbook.from_path(xlsx_path) as wb:
+            return list(wb.sheet_names)
+
+    wb = load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+@st.cache_data(show_spinner=False)
+def _autodetect_header_row_cached(xlsx_path: str, sheet_name: str):
+    return autodetect_header_row(xlsx_path, sheet_name)
+
+
+@st.cache_data(show_spinner=False)
+def _read_header_cached(xlsx_path: str, sheet_name: str, header_row: int | None) -> list:
+    return read_header(xlsx_path, sheet_name, header_row)
+
+
+@st.cache_data(show_spinner=False)
+def _load_dataframe_cached(xlsx_path: str, sheet_name: str, header_row: int | None,
+                           usecols: tuple | None = None, dtype: dict | None = None):
+    return load_dataframe(xlsx_path, sheet_name, header_row, usecols=usecols, dtype=dtype)
+
+
+# Tipos de célula tratados como número (bool fica de fora de propósito)
+_NUMERIC_TYPES = (int, float, np.integer, np.floating)
+
+
 def coerce_os_to_str(series: pd.Series) -> pd.Series:
-    def _conv(x):
-        if pd.isna(x):
-            return ""
-        # Muitos arquivos vêm com OS como float (ex.: 6000794541.0)
-        try:
-            if isinstance(x, (int,)):
-                return str(x)
-            if isinstance(x, float):
-                return str(int(x))
-            s = str(x).strip()
-            # remove .0
-            if s.endswith(".0"):
-                s = s[:-2]
-            return s
-        except Exception:
-            return str(x)
+    # texto: sem espaços e sem ".0" no final (zeros à esquerda são mantidos)
+    out = series.astype("string").str.strip().str.removesuffix(".0")
+
+    # Muitos arquivos vêm com OS como float (ex.: 6000794541.0): só células numéricas passam pelo Int64
+    if pd.api.types.is_bool_dtype(series):
+        return out.fillna("")
+    if pd.api.types.is_numeric_dtype(series):
+        is_num = series.notna()
+    else:
+        is_num = series.map(type, na_action="ignore").isin(_NUMERIC_TYPES)
+
+    if is_num.any():
+        num = pd.to_numeric(series[is_num], errors="coerce")
+        # fora do Int64 (inf, inteiros enormes) continua pela regra de texto
+        num = num[np.isfinite(num) & (num.abs() < 2**63)]
+        if pd.api.types.is_float_dtype(num):
+            num = np.trunc(num)
+        out[num.index] = num.astype("Int64").astype("string")
+    return out.fillna("")
+
 
-    return series.apply(_conv)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _csv_bytes(rows: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    rows.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
 
 
 # ======================================================
@@ -106,90 +316,175 @@ def coerce_os_to_str(series: pd.Series) -> pd.Series:
 # ======================================================
 
 def wait_not_busy(session, timeout=60):
+    # backoff exponencial: 5 ms dobrando até 50 ms (a maioria das ações termina rápido)
     t0 = time.time()
+    delay = 0.005
     while session.Busy:
         if time.time() - t0 > timeout:
             raise TimeoutError("SAP ficou ocupado tempo demais (Busy).")
-        time.sleep(0.1)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
 
 
-def connect_sap_session(connection_index: int = 0, session_index: int = 0):
+def connect_sap_session(connection_index: int = 0, session_index: int = 0, cache: dict | None = None):
+    # reaproveita a sessão COM entre execuções enquanto ela continuar viva
+    cache = cache if cache is not None else {}
+    key = (connection_index, session_index)
+    cached = cache.get("_sap")
+    if cached and cached["k"] == key:
+        try:
+            _ = cached["v"].Info.SystemName
+            return cached["v"]
+        except Exception:
+            pass
+
     sap = win32com.client.GetObject("SAPGUI")
     app = sap.GetScriptingEngine
     conn = app.Children(connection_index)
     sess = conn.Children(session_index)
+    cache["_sap"] = {"k": key, "v": sess}
     return sess
 
 
-def set_clipboard(texto: str):
-    # preserva quebras de linha
-    texto = (texto or "").replace("\n", "\r\n")
-    win32clipboard.OpenClipboard()
+def _open_clipboard(timeout: float = 0.5):
+    # outro processo pode estar com o clipboard aberto; tenta por alguns instantes
+    t0 = time.time()
+    while not _user32.OpenClipboard(None):
+        if time.time() - t0 > timeout:
+            raise ctypes.WinError(ctypes.get_last_error())
+        time.sleep(0.01)
+
+
+def set_clipboard_buffer(buf: bytes):
+    """Grava no clipboard um buffer UTF-16LE já terminado em NUL (CF_UNICODETEXT)."""
+    _open_clipboard()
     try:
-        win32clipboard.EmptyClipboard()
-        win32clipboard.SetClipboardText(texto)
+        if not _user32.EmptyClipboard():
+            raise ctypes.WinError(ctypes.get_last_error())
+        handle = _kernel32.GlobalAlloc(GMEM_MOVEABLE, len(buf))
+        if not handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+        dst = _kernel32.GlobalLock(handle)
+        if not dst:
+            err = ctypes.get_last_error()
+            _kernel32.GlobalFree(handle)
+            raise ctypes.WinError(err)
+        ctypes.memmove(dst, buf, len(buf))
+        _kernel32.GlobalUnlock(handle)
+        if not _user32.SetClipboardData(CF_UNICODETEXT, handle):
+            _kernel32.GlobalFree(handle)
+            raise ctypes.WinError(ctypes.get_last_error())
     finally:
-        win32clipboard.CloseClipboard()
+        _user32.CloseClipboard()
 
 
-def ensure_visible(tbl, abs_row: int, visible_rows: int):
-    if abs_row < visible_rows:
-        scroll_pos = 0
-    else:
-        scroll_pos = abs_row - (visible_rows - 1)
-    tbl.VerticalScrollbar.Position = scroll_pos
-    return abs_row - scroll_pos
+def to_clipboard_buffer(texto: str) -> bytes:
+    # preserva quebras de linha (só converte se o texto ainda não usa \r\n)
+    texto = texto or ""
+    if "\r" not in texto:
+        texto = texto.replace("\n", "\r\n")
+    return texto.encode("utf-16-le") + b"\x00\x00"
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _prep_clipboard_buffers(texts: tuple[str, ...]) -> list[bytes]:
+    return [to_clipboard_buffer(t) for t in texts]
 
 
-def open_iw32_and_load_os(session, os_str: str):
+def press_long_text_button(session, tbl, vis_row: int):
+    # célula da tabela direto pelo GuiTableControl; o caminho absoluto fica só como fallback
+    # só a busca do controle cai no fallback; o clique acontece uma única vez
+    try:
+        btn = tbl.GetCell(vis_row, SAP_IDS["COL_TEXTO_LONGO"])
+    except Exception:
+        btn = session.findById(SAP_IDS["BTN_TEXTO_LONGO_FMT"].format(row=vis_row))
+    btn.press
+
+
+def open_iw32_and_load_os(session, os_str: str, wnd0=None):
+    wnd0 = wnd0 or session.findById("wnd[0]")
     session.findById(SAP_IDS["OKCD_ID"]).text = "/nIW32"
-    session.findById("wnd[0]").sendVKey(0)
+    wnd0.sendVKey(0)
     wait_not_busy(session)
 
-    session.findById(SAP_IDS["OS_FIELD_ID"]).text = os_str
-    session.findById(SAP_IDS["OS_FIELD_ID"]).caretPosition = len(os_str)
-    session.findById("wnd[0]").sendVKey(0)
+    os_field = session.findById(SAP_IDS["OS_FIELD_ID"])
+    os_field.text = os_str
+    os_field.caretPosition = len(os_str)
+    wnd0.sendVKey(0)
     wait_not_busy(session)
 
 
-def push_to_sap(os_str: str, long_texts: list[str], visible_rows: int, save_after: bool,
-                connection_index: int, session_index: int, progress_cb=None, log_cb=None):
+def push_to_sap(os_str: str, buffers: list[bytes], visible_rows: int, save_after: bool,
+                connection_index: int, session_index: int, progress_cb=None, log_cb=None,
+                session_cache: dict | None = None, next_text_btn_id: str | None = None):
     if not platform.system().lower().startswith("win"):
         raise RuntimeError("Este envio ao SAP requer Windows (SAP GUI + COM).")
 
-    session = connect_sap_session(connection_index=connection_index, session_index=session_index)
-    session.findById("wnd[0]").maximize
+    session = connect_sap_session(connection_index=connection_index, session_index=session_index,
+                                  cache=session_cache)
+    wnd0 = session.findById("wnd[0]")
+    wnd0.maximize
 
     if log_cb:
         log_cb(f"Abrindo IW32 e carregando OS {os_str}...")
 
-    open_iw32_and_load_os(session, os_str)
+    open_iw32_and_load_os(session, os_str, wnd0=wnd0)
 
     # Aba Operações
     session.findById(SAP_IDS["TAB_OPERACOES_ID"]).select
     wait_not_busy(session)
 
     tbl = session.findById(SAP_IDS["TBL_PATH"])  # GuiTableControl
+    back_btn = session.findById(SAP_IDS["BTN_BACK_ID"])
+
+    total = len(buffers)
 
-    total = len(long_texts)
-    for i, texto in enumerate(long_texts):
+    # só rola a tabela quando a linha sai da janela visível atual; a linha alvo vai para o
+    # topo (limitado à última página, senão o SAP corta a posição e vis_row fica errado)
+    cur_top = 0
+    last_top = max(total - visible_rows, 0)
+
+    def vis_for(abs_row: int) -> int:
+        nonlocal cur_top
+        if not (cur_top <= abs_row < cur_top + visible_rows):
+            cur_top = min(abs_row, last_top)
+            tbl.VerticalScrollbar.Position = cur_top
+            wait_not_busy(session)
+        return abs_row - cur_top
+
+    in_editor = False
+    for i, buf in enumerate(buffers):
         if progress_cb:
             progress_cb((i + 1) / max(total, 1))
 
-        vis_row = ensure_visible(tbl, i, visible_rows)
+        if not in_editor:
+            vis_row = vis_for(i)
 
-        # abre texto longo da linha
-        session.findById(SAP_IDS["BTN_TEXTO_LONGO_FMT"].format(row=vis_row)).press
-        wait_not_busy(session)
+            # abre texto longo da linha
+            press_long_text_button(session, tbl, vis_row)
+            wait_not_busy(session)
 
         # cola do Excel via clipboard e aplica setDocum
-        set_clipboard(texto)
+        # (o shell do editor só existe com o texto longo aberto, então não dá para resolvê-lo antes do loop)
+        set_clipboard_buffer(buf)
         session.findById(SAP_IDS["LONGTEXT_SHELL_ID"]).setDocum
         wait_not_busy(session)
 
-        # voltar para a tabela
-        session.findById(SAP_IDS["BTN_BACK_ID"]).press
-        wait_not_busy(session)
+        # segue direto para o texto da próxima operação, sem voltar à tabela
+        in_editor = False
+        if next_text_btn_id and i < total - 1:
+            try:
+                session.findById(next_text_btn_id).press
+                wait_not_busy(session)
+                in_editor = True
+            except Exception:
+                # botão indisponível: usa o caminho voltar -> abrir no resto do lote
+                next_text_btn_id = None
+
+        if not in_editor:
+            # voltar para a tabela
+            back_btn.press
+            wait_not_busy(session)
 
         if log_cb:
             log_cb(f"Linha {i+1}/{total}: texto longo aplicado.")
@@ -206,6 +501,116 @@ def push_to_sap(os_str: str, long_texts: list[str], visible_rows: int, save_afte
     return True
 
 
+# ======================================================
+# UTILIDADES - SAP RFC (BAPI)
+# ======================================================
+
+def split_text_lines(texto: str, width: int = RFC_TEXT_LINE_LEN) -> list[dict]:
+    """Quebra o texto em linhas TDLINE: '*' abre parágrafo, '=' continua a linha anterior."""
+    lines = []
+    for paragraph in (texto or "").replace("\r\n", "\n").split("\n"):
+        chunks = [paragraph[i:i + width] for i in range(0, len(paragraph), width)] or [""]
+        for j, chunk in enumerate(chunks):
+            lines.append({"TDFORMAT": "*" if j == 0 else "=", "TDLINE": chunk})
+    return lines
+
+
+def push_to_sap_rfc(os_str: str, long_texts: list[str], operations: list[str], conn_params: dict,
+                    language: str = "PT", progress_cb=None, log_cb=None):
+    """Grava todos os textos longos da OS numa única chamada de BAPI_ALM_ORDER_MAINTAIN."""
+    if RfcConnection is None:
+        raise RuntimeError("pyrfc não está instalado (requer SAP NW RFC SDK).")
+
+    # operação vazia viraria "0000" e o texto iria para a atividade errada sem aviso
+    missing = [str(i + 1) for i, op in enumerate(operations) if not (op or "").strip()]
+    if missing:
+        raise ValueError(f"Operação vazia na(s) linha(s) {', '.join(missing)} da OS; nada foi enviado.")
+    if len(operations) != len(long_texts):
+        raise ValueError("Quantidade de operações e de textos longos não confere; nada foi enviado.")
+
+    order_id = os_str.zfill(12)
+    methods, texts, text_lines = [], [], []
+    for i, (activity, texto) in enumerate(zip(operations, long_texts)):
+        activity = activity.strip().zfill(4)
+        lines = split_text_lines(texto)
+        texts.append({
+            "ORDERID": order_id,
+            "ACTIVITY": activity,
+            "LANGU_ISO": language,
+            "TEXTSTART": len(text_lines) + 1,
+            "TEXTEND": len(text_lines) + len(lines),
+        })
+        text_lines.extend(lines)
+        methods.append({
+            "REFNUMBER": i + 1,
+            "OBJECTTYPE": "TEXT",
+            "METHOD": "CHANGE",
+            "OBJECTKEY": order_id + activity,
+        })
+    methods.append({"REFNUMBER": 1, "OBJECTTYPE": "", "METHOD": "SAVE", "OBJECTKEY": order_id})
+
+    if log_cb:
+        log_cb(f"Enviando {len(texts)} textos longos da OS {os_str} via RFC...")
+
+    conn = RfcConnection(**conn_params)
+    try:
+        result = conn.call(
+            "BAPI_ALM_ORDER_MAINTAIN",
+            IT_METHODS=methods,
+            IT_TEXT=texts,
+            IT_TEXT_LINES=text_lines,
+        )
+        errors = [r["MESSAGE"] for r in result.get("RETURN", []) if r.get("TYPE") in ("E", "A")]
+        if errors:
+            conn.call("BAPI_TRANSACTION_ROLLBACK")
+            raise RuntimeError("; ".join(errors))
+
+        if progress_cb:
+            progress_cb(0.9)
+        conn.call("BAPI_TRANSACTION_COMMIT", WAIT="X")
+    finally:
+        conn.close()
+
+    if log_cb:
+        log_cb("Salvo via RFC.")
+    if progress_cb:
+        progress_cb(1.0)
+
+    return True
+
+
+# ======================================================
+# EXECUÇÃO EM SEGUNDO PLANO
+# ======================================================
+
+@st.cache_resource
+def _sap_executor() -> ThreadPoolExecutor:
+    # uma única thread fixa: objetos COM do SAP GUI só valem na thread (apartment) que os criou
+    initializer = pythoncom.CoInitialize if platform.system().lower().startswith("win") else None
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="sap", initializer=initializer)
+
+
+@st.cache_resource
+def _sap_session_cache() -> dict:
+    # usado só pela thread do executor (ver connect_sap_session)
+    return {}
+
+
+def run_in_background(fn, **kwargs) -> queue.Queue:
+    """Roda fn na thread do SAP; progresso, logs e o resultado final chegam pela fila."""
+    q = queue.Queue()
+
+    def worker():
+        try:
+            fn(**kwargs, progress_cb=lambda v: q.put(("p", v)), log_cb=lambda m: q.put(("l", m)))
+            q.put(("done", None))
+        except Exception as e:
+            q.put(("err", e))
+
+    _sap_executor().submit(worker)
+    return q
+
+
 # ======================================================
 # STREAMLIT APP
 # ======================================================
@@ -226,81 +631,141 @@ with st.expander("⚠️ Pré-requisitos", expanded=True):
 """
     )
 
+def _discard_previous_upload():
+    # apaga o temporário do arquivo anterior e descarta o que foi lido dele
+    old_path = st.session_state.pop("xlsx_path", None)
+    if old_path is None:
+        return
+    _remove_file(old_path)
+    st.session_state.pop("xlsx_file_id", None)
+    st.session_state.pop("_os_arr", None)
+    st.session_state.pop("_sap_job", None)
+    st.session_state.pop("_sap_result", None)
+    # clear() esvazia o cache de todas as sessões, não só desta. Aceitável aqui: o app roda
+    # no PC do próprio usuário do SAP (uma sessão); outra sessão só relê a planilha dela do disco.
+    for fn in (_calamine_sheet, _sheet_names, _autodetect_header_row_cached, _read_header_cached,
+               _load_dataframe_cached, _csv_bytes, _prep_clipboard_buffers):
+        fn.clear()
+    gc.collect()
+
+
 uploaded = st.file_uploader("1) Envie a planilha (.xlsx)", type=["xlsx"])
 
 if uploaded is None:
+    _discard_previous_upload()
     st.stop()
 
-excel_bytes = uploaded.read()
+# grava o upload em disco uma vez por arquivo; reruns reaproveitam o caminho
+if st.session_state.get("xlsx_file_id") != uploaded.file_id:
+    _discard_previous_upload()
+    st.session_state["xlsx_path"] = _spill_to_tempfile(uploaded)
+    st.session_state["xlsx_file_id"] = uploaded.file_id
+# a partir daqui só o arquivo em disco é usado. Os bytes do upload continuam com o
+# gerenciador de uploads do Streamlit até o arquivo ser removido do widget.
+xlsx_path = st.session_state["xlsx_path"]
 
 # Seleção de aba
 try:
-    xls = pd.ExcelFile(BytesIO(excel_bytes), engine="openpyxl")
-    sheet = st.selectbox("2) Selecione a aba (sheet)", xls.sheet_names)
+    sheet = st.selectbox("2) Selecione a aba (sheet)", _sheet_names(xlsx_path))
 except Exception as e:
     st.error(f"Não consegui ler o arquivo Excel: {e}")
     st.stop()
 
 # Detecta header
-auto_header = autodetect_header_row(excel_bytes, sheet)
+auto_header = _autodetect_header_row_cached(xlsx_path, sheet)
 col1, col2 = st.columns([1, 1])
 with col1:
     use_auto = st.checkbox("Detectar cabeçalho automaticamente", value=True)
 with col2:
     header_row = st.number_input("Linha do cabeçalho (0 = primeira)", min_value=0, max_value=200, value=int(auto_header if auto_header is not None else 3))
 
+effective_header = header_row if not use_auto else (auto_header if auto_header is not None else header_row)
+
+# Fase 1: só o cabeçalho, para o mapeamento de colunas
 try:
-    df = load_dataframe(excel_bytes, sheet, header_row if not use_auto else (auto_header if auto_header is not None else header_row))
+    cols = _read_header_cached(xlsx_path, sheet, effective_header)
 except Exception as e:
     st.error(f"Erro ao carregar dados: {e}")
     st.stop()
 
-# Mapeamento de colunas (caso o usuário use outra variação)
-cols = list(df.columns)
-cols_lower = [str(c).strip().lower() for c in cols]
+if not cols:
+    st.error("A linha de cabeçalho escolhida está vazia.")
+    st.stop()
 
-def _suggest(name: str):
-    name = name.lower()
-    for c in cols:
-        if str(c).strip().lower() == name:
-            return c
+# Mapeamento de colunas (caso o usuário use outra variação)
+# índices montados uma vez: nome normalizado -> coluna original, coluna -> posição
+lower_to_orig = {}
+col_pos = {}
+for i, c in enumerate(cols):
+    lower_to_orig.setdefault(str(c).strip().lower(), c)
+    col_pos.setdefault(c, i)
+
+def _suggest(*names: str):
+    names = [n.lower() for n in names]
+    for name in names:
+        if name in lower_to_orig:
+            return lower_to_orig[name]
     # fallback aproximado
-    for c in cols:
-        if name in str(c).strip().lower():
-            return c
+    for name in names:
+        for k, c in lower_to_orig.items():
+            if name in k:
+                return c
     return cols[0]
 
+os_default = col_pos[_suggest("os")]
+texto_default = col_pos[_suggest("máscara", "mascara")]
+
+# coluna de operação (usada no envio via RFC), aceitando variações de caixa e acento
+map_col_op = next((c for c in cols if _fold(c) == "operacao"), None)
+
 st.subheader("3) Mapeamento de colunas")
-map_col_os = st.selectbox("Coluna da OS (ordem)", cols, index=cols.index(_suggest("os")) if _suggest("os") in cols else 0)
-map_col_texto = st.selectbox("Coluna do Texto Longo", cols, index=cols.index(_suggest("máscara")) if _suggest("máscara") in cols else (cols.index(_suggest("mascara")) if _suggest("mascara") in cols else 0))
+map_col_os = st.selectbox("Coluna da OS (ordem)", cols, index=os_default)
+map_col_texto = st.selectbox("Coluna do Texto Longo", cols, index=texto_default)
+
+# Fase 2: lê só as colunas usadas, com OS e texto longo já como string
+wanted = tuple(dict.fromkeys(c for c in [map_col_os, map_col_texto, map_col_op, *PREVIEW_COLS] if c is not None))
+try:
+    df = _load_dataframe_cached(
+        xlsx_path, sheet, effective_header,
+        usecols=wanted,
+        dtype={map_col_os: "string", map_col_texto: "string"},
+    )
+except Exception as e:
+    st.error(f"Erro ao carregar dados: {e}")
+    st.stop()
 
 # Prepara OS
 if map_col_os not in df.columns:
     st.error("Coluna de OS não encontrada.")
     st.stop()
 
-work = df.copy()
-work["OS_str"] = coerce_os_to_str(work[map_col_os])
-work = work[work["OS_str"] != ""]
+# OS normalizada fica em cache na sessão como array numpy (sem copiar o dataframe)
+os_key = (xlsx_path, sheet, effective_header, map_col_os)
+cached_os = st.session_state.get("_os_arr")
+if cached_os is None or cached_os[0] != os_key:
+    cached_os = (os_key, coerce_os_to_str(df[map_col_os]).to_numpy(dtype=object))
+    st.session_state["_os_arr"] = cached_os
+os_arr = cached_os[1]
+
+os_list = pd.unique(os_arr[os_arr != ""])
 
-if work.empty:
+if len(os_list) == 0:
     st.warning("Não encontrei nenhuma OS válida na planilha.")
     st.stop()
 
-os_list = work["OS_str"].dropna().unique().tolist()
-
 st.subheader("4) Escolha a OS e confira os dados")
 selected_os = st.selectbox("OS", os_list)
 
-rows_os = work[work["OS_str"] == selected_os].copy()
-
 # Ordenação: mantém ordem original do arquivo (índice)
-rows_os = rows_os.reset_index(drop=False).rename(columns={"index": "_linha_excel"})
+mask = os_arr == selected_os
+rows_os = df.iloc[mask].reset_index(drop=False).rename(columns={"index": "_linha_excel"})
 
 # Colunas para exibição
 show_mask = st.checkbox("Mostrar coluna do texto longo na tabela (pode ficar pesado)", value=False)
 
-default_show = [c for c in ["_linha_excel", map_col_os, "Operação", "Material", "Texto breve material", "Quantidade", "Centro"] if c in rows_os.columns]
+default_show = list(dict.fromkeys(
+    c for c in ["_linha_excel", map_col_os, map_col_op, *PREVIEW_COLS] if c is not None and c in rows_os.columns
+))
 
 if show_mask:
     default_show.append(map_col_texto)
@@ -318,7 +783,7 @@ st.text_area("Texto longo", preview_text, height=220)
 # Botão para exportar prévia
 st.download_button(
     "Baixar prévia (CSV)",
-    data=rows_os.to_csv(index=False).encode("utf-8"),
+    data=_csv_bytes(rows_os),
     file_name=f"preview_OS_{selected_os}.csv",
     mime="text/csv",
 )
@@ -327,25 +792,58 @@ st.divider()
 
 st.subheader("5) Enviar para o SAP (IW32)")
 
-if not platform.system().lower().startswith("win"):
+use_rfc = st.checkbox(
+    "Usar RFC (rápido)",
+    value=False,
+    disabled=RfcConnection is None,
+    help="Grava todos os textos numa única chamada BAPI_ALM_ORDER_MAINTAIN (requer pyrfc + SAP NW RFC SDK).",
+)
+
+if not use_rfc and not platform.system().lower().startswith("win"):
     st.error("Este recurso só funciona no Windows (SAP GUI Scripting via COM).")
     st.stop()
 
-ack = st.checkbox("✅ SAP GUI está aberto e eu estou logado. Quero executar a automação.", value=False)
-
-c1, c2, c3 = st.columns([1, 1, 1])
-with c1:
-    visible_rows = st.number_input("Linhas visíveis na tabela", min_value=5, max_value=30, value=VISIBLE_ROWS_DEFAULT)
-with c2:
-    conn_idx = st.number_input("Connection index", min_value=0, max_value=9, value=0)
-with c3:
-    sess_idx = st.number_input("Session index", min_value=0, max_value=9, value=0)
+if use_rfc:
+    ack = st.checkbox("✅ Tenho acesso RFC ao sistema SAP. Quero executar a gravação.", value=False)
+
+    r1, r2, r3 = st.columns([1, 1, 1])
+    with r1:
+        rfc_ashost = st.text_input("Servidor de aplicação (ashost)")
+        rfc_user = st.text_input("Usuário")
+    with r2:
+        rfc_sysnr = st.text_input("Número do sistema (sysnr)", value="00")
+        rfc_passwd = st.text_input("Senha", type="password")
+    with r3:
+        rfc_client = st.text_input("Mandante (client)")
+        rfc_lang = st.text_input("Idioma do texto (código ISO)", value="PT")
+
+    st.info("Via RFC a ordem é sempre salva (BAPI_TRANSACTION_COMMIT) ao final.")
+else:
+    ack = st.checkbox("✅ SAP GUI está aberto e eu estou logado. Quero executar a automação.", value=False)
+
+    c1, c2, c3 = st.columns([1, 1, 1])
+    with c1:
+        visible_rows = st.number_input("Linhas visíveis na tabela", min_value=5, max_value=30, value=VISIBLE_ROWS_DEFAULT)
+    with c2:
+        conn_idx = st.number_input("Connection index", min_value=0, max_value=9, value=0)
+    with c3:
+        sess_idx = st.number_input("Session index", min_value=0, max_value=9, value=0)
+
+    save_after = st.checkbox("Salvar a OS ao final", value=True)
+
+    next_text_btn_id = st.text_input(
+        "ID do botão 'próxima operação' no editor de texto longo (opcional)",
+        value=SAP_IDS["BTN_NEXT_TEXT_ID"],
+        help="Ex.: wnd[0]/tbar[1]/btn[NN]. Quando informado, o editor passa direto para o texto da operação "
+             "seguinte em vez de voltar à tabela a cada linha.",
+    )
 
-save_after = st.checkbox("Salvar a OS ao final", value=True)
+    st.info("Dica: durante a execução, **não mexa no SAP** (mouse/teclado) para evitar perder foco.")
 
-st.info("Dica: durante a execução, **não mexa no SAP** (mouse/teclado) para evitar perder foco.")
+# job em andamento fica na sessão até a thread do SAP terminar
+job_running = "_sap_job" in st.session_state
 
-run_btn = st.button("🚀 Enviar texto longo para o SAP", type="primary", disabled=not ack)
+run_btn = st.button("🚀 Enviar texto longo para o SAP", type="primary", disabled=not ack or job_running)
 
 if run_btn:
     if map_col_texto not in rows_os.columns:
@@ -354,27 +852,89 @@ if run_btn:
 
     long_texts = rows_os[map_col_texto].fillna("").astype(str).tolist()
 
-    prog = st.progress(0.0)
-    log_area = st.empty()
-    logs = []
-
-    def log_cb(msg):
-        logs.append(msg)
-        # mostra os últimos 15 logs
-        log_area.code("\n".join(logs[-15:]))
-
-    try:
-        push_to_sap(
+    if use_rfc:
+        # número da operação precisa vir da planilha: a numeração no SAP não é sempre de 10 em 10
+        if map_col_op is None or map_col_op not in rows_os.columns:
+            st.error("Envio via RFC exige uma coluna 'Operação' na planilha; nada foi enviado.")
+            st.stop()
+        operations = coerce_os_to_str(rows_os[map_col_op]).tolist()
+        q = run_in_background(
+            push_to_sap_rfc,
             os_str=selected_os,
             long_texts=long_texts,
+            operations=operations,
+            conn_params={
+                "ashost": rfc_ashost,
+                "sysnr": rfc_sysnr,
+                "client": rfc_client,
+                "user": rfc_user,
+                "passwd": rfc_passwd,
+            },
+            language=rfc_lang,
+        )
+    else:
+        q = run_in_background(
+            push_to_sap,
+            os_str=selected_os,
+            buffers=_prep_clipboard_buffers(tuple(long_texts)),
             visible_rows=int(visible_rows),
             save_after=save_after,
             connection_index=int(conn_idx),
             session_index=int(sess_idx),
-            progress_cb=lambda v: prog.progress(min(max(float(v), 0.0), 1.0)),
-            log_cb=log_cb,
+            session_cache=_sap_session_cache(),
+            next_text_btn_id=next_text_btn_id.strip() or None,
         )
+
+    st.session_state["_sap_job"] = {"q": q, "use_rfc": use_rfc, "logs": [], "progress": 0.0}
+    job_running = True
+
+
+def _show_job(job: dict):
+    st.progress(job["progress"])
+    # mostra os últimos 15 logs
+    st.code("\n".join(job["logs"][-15:]))
+
+
+@st.fragment(run_every=0.25)
+def _sap_job_monitor():
+    # só este trecho é reexecutado a cada 250 ms enquanto o envio roda
+    job = st.session_state.get("_sap_job")
+    if job is None:
+        return
+
+    status = None
+    while True:
+        try:
+            kind, value = job["q"].get_nowait()
+        except queue.Empty:
+            break
+        if kind == "p":
+            job["progress"] = min(max(float(value), 0.0), 1.0)
+        elif kind == "l":
+            job["logs"].append(value)
+        else:
+            status = (kind, value)
+
+    if status is None:
+        _show_job(job)
+        return
+
+    # terminou: o resultado é mostrado uma vez no próximo rerun completo
+    del st.session_state["_sap_job"]
+    st.session_state["_sap_result"] = {**job, "status": status}
+    st.rerun()
+
+
+if job_running:
+    _sap_job_monitor()
+
+result = st.session_state.pop("_sap_result", None)
+if result is not None:
+    _show_job(result)
+    kind, value = result["status"]
+    if kind == "done":
         st.success("✅ Envio concluído com sucesso!")
-    except Exception as e:
-        st.error(f"Falha ao executar: {e}")
-        st.warning("Se o SAP tiver mais de uma sessão aberta, ajuste Connection/Session index.")
+    else:
+        st.error(f"Falha ao executar: {value}")
+        if not result["use_rfc"]:
+            st.warning("Se o SAP tiver mais de uma sessão aberta, ajuste Connection/Session index.")